@@ -1,2 +1,2 @@
-from .client import CampaiClient, CampaiAuth
-from .model import Contact, Organisation
+from .client import CampaiClient, AsyncCampaiClient, CampaiAuth
+from .model import Contact, Organisation, contact_from_cache
@@ -1,11 +1,12 @@
+from functools import lru_cache
 from typing import Generator, Unpack
 
 import httpx
 from httpx import Request, Response
 from pydantic import RootModel
 
-from .model import ResourceT, Organisation, Contact
-from .params import GetListKwargs, build_page_params, build_filter_params
+from .model import ResourceT, Organisation, Contact, ResourceCount
+from .params import GetListKwargs, build_page_params
 
 
 class CampaiAuth(httpx.Auth):
@@ -17,31 +18,89 @@ class CampaiAuth(httpx.Auth):
         yield request
 
 
+def _build_request_params(params: GetListKwargs) -> dict:
+    # extend the page param dict in place instead of merging a third dict per request
+    request_params = build_page_params(params.get("page", None))
+    filter_params = params.get("filter", None)
+
+    if filter_params:
+        request_params.update(filter_params)
+
+    return request_params
+
+
+@lru_cache(maxsize=None)
+def _list_resource_model(resource_type: type[ResourceT]) -> type[RootModel]:
+    # memoized so the pydantic schema for a page of resources is only built once per resource type
+    return RootModel[list[resource_type]]
+
+
+def _parse_resource_list(resource_type: type[ResourceT], r: httpx.Response) -> list[ResourceT]:
+    r.raise_for_status()
+
+    # validating the raw response bytes directly skips the intermediate dict that r.json() builds
+    return _list_resource_model(resource_type).model_validate_json(r.content).root
+
+
+def _merge_organisation_filter(organisation: Organisation | str, params: GetListKwargs) -> GetListKwargs:
+    organisation_id = organisation
+
+    if isinstance(organisation, Organisation):
+        organisation_id = organisation.id
+
+    filter_params = params.get("filter", None) or {}
+    params["filter"] = filter_params | {"organisation": organisation_id}
+
+    return params
+
+
 class CampaiClient(object):
     def __init__(self, client: httpx.Client):
         self.__client = client
 
-    def __get_resources(self, resource_type: type[ResourceT], *path: str, **params: Unpack[GetListKwargs]):
-        page_params = params.get("page", None)
-        filter_params = params.get("filter", None)
-        request_params = build_page_params(page_params) | build_filter_params(filter_params)
+    def __enter__(self):
+        self.__client.__enter__()
+        return self
 
-        r = self.__client.get("/".join(path), params=request_params)
-        assert r.status_code == httpx.codes.OK.value, "unexpected status code"
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__client.__exit__(exc_type, exc_value, traceback)
 
-        list_resource_t = RootModel[list[resource_type]]
-        return list_resource_t(r.json()).root
+    def __get_resources(self, resource_type: type[ResourceT], *path: str, **params: Unpack[GetListKwargs]):
+        r = self.__client.get("/".join(path), params=_build_request_params(params))
+        return _parse_resource_list(resource_type, r)
 
     def get_organisations(self, **params: Unpack[GetListKwargs]) -> list[Organisation]:
         return self.__get_resources(Organisation, "organisations", **params)
 
     def get_contacts(self, organisation: Organisation | str, **params: Unpack[GetListKwargs]) -> list[Contact]:
-        organisation_id = organisation
+        return self.__get_resources(Contact, "contacts", **_merge_organisation_filter(organisation, params))
+
+
+class AsyncCampaiClient(object):
+    def __init__(self, client: httpx.AsyncClient):
+        self.__client = client
+
+    async def __aenter__(self):
+        await self.__client.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.__client.__aexit__(exc_type, exc_value, traceback)
+
+    async def __get_resources(self, resource_type: type[ResourceT], *path: str, **params: Unpack[GetListKwargs]):
+        r = await self.__client.get("/".join(path), params=_build_request_params(params))
+        return _parse_resource_list(resource_type, r)
+
+    async def get_organisations(self, **params: Unpack[GetListKwargs]) -> list[Organisation]:
+        return await self.__get_resources(Organisation, "organisations", **params)
 
-        if isinstance(organisation, Organisation):
-            organisation_id = organisation.id
+    async def get_contacts(self, organisation: Organisation | str, **params: Unpack[GetListKwargs]) -> list[Contact]:
+        return await self.__get_resources(Contact, "contacts", **_merge_organisation_filter(organisation, params))
 
-        filter_params = params.get("filter", None) or {}
-        params["filter"] = filter_params | {"organisation": organisation_id}
+    async def get_contacts_total(self, organisation: Organisation | str) -> int:
+        # https://docs2.campai.com/queryLanguage => mode=count returns the total number of matches
+        params = _merge_organisation_filter(organisation, {})
+        r = await self.__client.get("contacts", params=params["filter"] | {"mode": "count"})
+        r.raise_for_status()
 
-        return self.__get_resources(Contact, "contacts", **params)
+        return ResourceCount.model_validate_json(r.content).count
@@ -1,7 +1,8 @@
 from datetime import datetime
+from functools import cached_property
 from typing import Annotated, TypeVar, Literal, Any
 
-from pydantic import ConfigDict, BaseModel, Field, EmailStr, BeforeValidator
+from pydantic import ConfigDict, BaseModel, Field, BeforeValidator
 from pydantic.alias_generators import to_camel
 
 ResourceT = TypeVar("ResourceT", bound="BaseModel")
@@ -12,7 +13,9 @@ def convert_empty_str_to_none(v: str) -> str | None:
 
 
 class CampaiBaseModel(BaseModel):
-    model_config = ConfigDict(alias_generator=to_camel)
+    # campai resources are read-only snapshots, so the models can be frozen; ignoring extra fields
+    # and allowing field names next to aliases keeps validation of large contact pages cheap
+    model_config = ConfigDict(alias_generator=to_camel, validate_by_name=True, frozen=True, extra="ignore")
 
 
 class IdMixin(BaseModel):
@@ -24,6 +27,10 @@ class MetadataMixin(BaseModel):
     updated_at: datetime
 
 
+class ResourceCount(CampaiBaseModel):
+    count: int
+
+
 class Organisation(CampaiBaseModel, IdMixin, MetadataMixin):
     merge_tags: dict[str, Any]
     name: str
@@ -40,7 +47,15 @@ class ContactPersonal(CampaiBaseModel):
 
 
 class ContactCommunication(CampaiBaseModel):
-    email: Annotated[EmailStr | None, BeforeValidator(convert_empty_str_to_none)]
+    # deliberately not an EmailStr: syntactic validation of every contact email is expensive and
+    # the value is only used for equality checks and lowercasing, keycloak validates on its own
+    email: Annotated[str | None, BeforeValidator(convert_empty_str_to_none)]
+
+    @cached_property
+    def email_lower(self) -> str | None:
+        # keycloak automatically lowercases emails, so comparisons against keycloak always need
+        # the lowercased form
+        return None if self.email is None else str(self.email).lower()
 
 
 class ContactMembership(CampaiBaseModel):
@@ -56,3 +71,38 @@ class Contact(CampaiBaseModel, IdMixin, MetadataMixin):
     personal: ContactPersonal
     membership: ContactMembership
     communication: ContactCommunication
+
+
+def _datetime_from_cache(value: str | None) -> datetime | None:
+    return None if value is None else datetime.fromisoformat(value)
+
+
+def contact_from_cache(data: dict) -> Contact:
+    """Rebuild a contact from the local cache file without re-running validation.
+
+    The cache is written with model_dump(mode="json", by_alias=True) on contacts that were already
+    validated, so model_construct can be used and only datetime fields need to be coerced by hand.
+    """
+    personal = data["personal"]
+    membership = data["membership"]
+
+    return Contact.model_construct(
+        id=data["_id"],
+        created_at=_datetime_from_cache(data["createdAt"]),
+        updated_at=_datetime_from_cache(data["updatedAt"]),
+        merge_tags=data["mergeTags"],
+        personal=ContactPersonal.model_construct(
+            is_person=personal["isPerson"],
+            is_organisation=personal["isOrganisation"],
+            person_first_name=personal["personFirstName"],
+            person_last_name=personal["personLastName"],
+        ),
+        membership=ContactMembership.model_construct(
+            enter_date=_datetime_from_cache(membership["enterDate"]),
+            leave_date=_datetime_from_cache(membership["leaveDate"]),
+            termination_date=_datetime_from_cache(membership["terminationDate"]),
+            status=membership["status"],
+            number_sort=membership["numberSort"],
+        ),
+        communication=ContactCommunication.model_construct(email=data["communication"]["email"]),
+    )
@@ -22,7 +22,3 @@ def build_page_params(params: PageParams | None):
         params = {}
 
     return {"limit": params.get("limit", DEFAULT_PAGE_LIMIT), "skip": params.get("skip", DEFAULT_PAGE_SKIP)}
-
-
-def build_filter_params(params: FilterParams | None):
-    return params or {}
@@ -1,19 +1,37 @@
-import json
+import asyncio
+import itertools
+import math
+import re
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from enum import IntFlag
 from pathlib import Path
-from typing import NamedTuple
+from typing import Callable, NamedTuple
 
 import click
 import httpx
+import orjson
 from keycloak import KeycloakAdmin, KeycloakOpenIDConnection
 from loguru import logger
-from pydantic import RootModel
+from pydantic import TypeAdapter
 
 from les_campai_connector import kc, uptime
-from les_campai_connector.campai import CampaiClient, CampaiAuth, Contact
+from les_campai_connector.campai import (
+    CampaiClient,
+    AsyncCampaiClient,
+    CampaiAuth,
+    Contact,
+    Organisation,
+    contact_from_cache,
+)
 from les_campai_connector.config import Settings
-from les_campai_connector.kc import MinimalUpdateUserRepresentation
+from les_campai_connector.kc import (
+    MinimalGroupRepresentation,
+    MinimalUpdateUserRepresentation,
+    MinimalUserRepresentation,
+)
 
 
 class MemberAction(IntFlag):
@@ -34,380 +52,476 @@ class MemberAction(IntFlag):
 NO_ACTION = 0
 UPDATE_ACTIONS = ~(MemberAction.CREATE | MemberAction.ACTIVATE | MemberAction.DEACTIVATE)
 
+# raw int copies of the masks tested in the hot loops, so flag checks are plain int arithmetic
+# instead of IntFlag operator round-trips; values are only boxed back for the preview repr
+ACTION_CREATE = int(MemberAction.CREATE)
+ACTION_ACTIVATE = int(MemberAction.ACTIVATE)
+ACTION_DEACTIVATE = int(MemberAction.DEACTIVATE)
+ACTION_ADD_DEFAULT_GROUP = int(MemberAction.ADD_DEFAULT_GROUP)
+ACTION_REMOVE_ALL_GROUPS = int(MemberAction.REMOVE_ALL_GROUPS)
+UPDATE_ACTIONS_MASK = int(UPDATE_ACTIONS)
+
 ALLOWED_USERNAME_LETTERS = string.ascii_letters + string.digits + ".-_"
+UNSAFE_USERNAME_LETTERS = re.compile(f"[^{re.escape(ALLOWED_USERNAME_LETTERS)}]")
+
+# fold german umlauts in one C-level pass so "müller" becomes "mueller" instead of "mller"
+UMLAUT_TRANSLATION = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "Ä": "Ae", "Ö": "Oe", "Ü": "Ue", "ß": "ss"})
+
+CONTACT_PAGE_LIMIT = 50
+CONTACT_PAGE_CONCURRENCY = 8
+
+CACHE_WRITE_CHUNK = 1000
+
+CONTACT_LIST_ADAPTER = TypeAdapter(list[Contact])
+
+# preview line prefixes, styled once at module scope instead of per secho call
+PREFIX_CREATE = click.style("[*] ", bold=True, fg="blue")
+PREFIX_ACTIVATE = click.style("[*] ", bold=True, fg="green")
+PREFIX_DEACTIVATE = click.style("[-] ", bold=True, fg="red")
+PREFIX_UPDATE = click.style("[~] ", bold=True, fg="yellow")
 
 
 class SyncOperation(NamedTuple):
     kc_user: dict | None
+    kc_user_parsed: MinimalUserRepresentation | None
     contact: Contact
     actions: MemberAction
 
 
+def _add_no_member_suffix(update_user: MinimalUpdateUserRepresentation, contact: Contact):
+    update_user.username = update_user.username + kc.NO_MEMBER_SUFFIX
+
+
+def _remove_no_member_suffix(update_user: MinimalUpdateUserRepresentation, contact: Contact):
+    # str.removesuffix strips exactly the suffix; rstrip would treat it as a character set and also
+    # eat trailing letters of the username itself
+    update_user.username = update_user.username.removesuffix(kc.NO_MEMBER_SUFFIX)
+
+
+# field updates driven by the action flags, applied in order with a single bit-test each. the
+# username suffix handlers rely on update_user.username having been populated beforehand, which
+# the order below preserves. email could be None so this must be accounted for.
+UPDATE_HANDLERS: list[tuple[MemberAction, Callable[[MinimalUpdateUserRepresentation, Contact], None]]] = [
+    (MemberAction.ACTIVATE, lambda update_user, contact: setattr(update_user, "enabled", True)),
+    (MemberAction.DEACTIVATE, lambda update_user, contact: setattr(update_user, "enabled", False)),
+    (
+        MemberAction.UPDATE_EMAIL,
+        lambda update_user, contact: setattr(update_user, "email", contact.communication.email_lower),
+    ),
+    (
+        MemberAction.UPDATE_FIRST_NAME,
+        lambda update_user, contact: setattr(update_user, "first_name", contact.personal.person_first_name),
+    ),
+    (
+        MemberAction.UPDATE_LAST_NAME,
+        lambda update_user, contact: setattr(update_user, "last_name", contact.personal.person_last_name),
+    ),
+    (
+        MemberAction.ADD_CAMPAI_ID,
+        lambda update_user, contact: setattr(update_user, "attributes", {kc.ATTRIBUTE_CAMPAI_ID: [contact.id]}),
+    ),
+    (MemberAction.ADD_NO_MEMBER_SUFFIX, _add_no_member_suffix),
+    (MemberAction.REMOVE_NO_MEMBER_SUFFIX, _remove_no_member_suffix),
+    (MemberAction.SET_EMAIL_VALIDATED, lambda update_user, contact: setattr(update_user, "email_verified", True)),
+]
+
+
 @click.group()
 def app():
     logger.add(Path(__file__).parent.parent / "logs" / "les-campai-connector.log", level="DEBUG")
 
 
 def sanitize_username(username: str) -> str:
-    sanitized_username = ""
-
-    for c in username:
-        # if it's an allowed letter, simply append
-        if c in ALLOWED_USERNAME_LETTERS:
-            sanitized_username += c
-            continue
-
-        # if it's a whitespace, sub with underscore
-        if c == " ":
-            sanitized_username += "_"
-
-    return sanitized_username
+    # fold umlauts and sub whitespaces with underscores first, then drop everything that isn't an
+    # allowed letter
+    return UNSAFE_USERNAME_LETTERS.sub("", username.translate(UMLAUT_TRANSLATION).replace(" ", "_"))
 
 
 def is_contact_active(contact: Contact):
     return contact.membership.status in ("willLeave", "isActive")
 
 
-def _do_sync(settings: Settings, cache_to: Path | None, cache_from: Path | None):
-    logger.info(f"Using Campai API at {settings.campai.base_url}")
-
-    campai = CampaiClient(
-        client=httpx.Client(
-            base_url=settings.campai.base_url, auth=CampaiAuth(settings.campai.api_key.get_secret_value())
+async def _fetch_contacts(settings: Settings, organisation: Organisation) -> list[Contact]:
+    # fetching contacts is purely I/O-bound, so ask for the total count first and request all pages
+    # at once, with the number of in-flight requests bounded to avoid campai rate limits
+    async with AsyncCampaiClient(
+        client=httpx.AsyncClient(
+            base_url=settings.campai.base_url,
+            auth=CampaiAuth(settings.campai.api_key.get_secret_value()),
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+            timeout=httpx.Timeout(10.0, connect=5.0),
         )
-    )
-
-    organisations = campai.get_organisations(filter={"name": settings.sync.organisation_name})
+    ) as campai:
+        total = await campai.get_contacts_total(organisation)
+        semaphore = asyncio.Semaphore(CONTACT_PAGE_CONCURRENCY)
+
+        async def fetch_page(page_skip: int) -> list[Contact]:
+            async with semaphore:
+                return await campai.get_contacts(organisation, page={"limit": CONTACT_PAGE_LIMIT, "skip": page_skip})
+
+        pages = await asyncio.gather(*(fetch_page(s) for s in range(0, total, CONTACT_PAGE_LIMIT)))
+        return list(itertools.chain.from_iterable(pages))
+
+
+def _apply_sync_op(
+    kc_admin: KeycloakAdmin,
+    default_group: MinimalGroupRepresentation,
+    claimed_usernames: set[str],
+    claimed_usernames_lock: threading.Lock,
+    sync_op: SyncOperation,
+):
+    contact = sync_op.contact
+    actions = int(sync_op.actions)
+
+    # create a new empty user that will contain fields to be updated
+    update_user = MinimalUpdateUserRepresentation()
+
+    # first check if the user needs to created, in which case a username will be generated
+    if actions & ACTION_CREATE:
+        if contact.communication.email is None:
+            logger.warning(
+                f"User for {contact.personal.person_first_name} {contact.personal.person_last_name} "
+                f"cannot be created: email is missing"
+            )
+            return
 
-    if len(organisations) != 1:
-        logger.error(
-            f'Expected to find one organisation named "{settings.sync.organisation_name}", found {len(organisations)}'
-        )
-        exit(1)
+        # even for a malformed email, taking everything before the first "@" is safe
+        contact_email_name = str(contact.communication.email).partition("@")[0]
 
-    organisation = organisations.pop()
-    logger.info(f'Found organisation named "{organisation.name}" with ID {organisation.id}')
+        # try to find a unique username with a single prefix search instead of one query per candidate;
+        # the lock makes sure that two users created at the same time cannot claim the same username.
+        # keycloak matches and stores usernames lowercased, so the candidates must be lowercased too,
+        # otherwise the client-side comparison would miss existing users that only differ in case
+        base_username = sanitize_username(contact_email_name).lower()
 
-    logger.info(f"Using Keycloak Admin API at {settings.keycloak.url} as {settings.keycloak.client_id}")
+        with claimed_usernames_lock:
+            taken_usernames = kc.find_taken_usernames(kc_admin, base_username) | claimed_usernames
 
-    kc_admin = KeycloakAdmin(
-        connection=KeycloakOpenIDConnection(
-            server_url=settings.keycloak.url,
-            realm_name=settings.keycloak.realm_name,
-            client_id=settings.keycloak.client_id,
-            client_secret_key=settings.keycloak.client_secret.get_secret_value(),
-        )
-    )
+            for username_idx in itertools.count():
+                # if username_idx == 0, then we try the base username first with no modifications,
+                # otherwise add an increasing number to the username
+                username = base_username if username_idx == 0 else base_username + str(username_idx)
 
-    default_group_raw = kc.find_group_by_name(kc_admin, settings.sync.default_group_name)
-
-    if default_group_raw is None:
-        logger.error(f'Couldn\'t find Keycloak group named "{settings.sync.default_group_name}"')
-        exit(1)
-
-    default_group = kc.must_parse_into_group(default_group_raw)
-    logger.info(f'Found group named "{default_group.name}" with ID {default_group.id}')
-    logger.info("Fetching users from Campai")
+                # if no user was found by this username, use it to create this user
+                if username not in taken_usernames:
+                    update_user.username = username
+                    claimed_usernames.add(username)
+                    break
 
-    if cache_from is not None:
-        with cache_from.open(mode="r", encoding="utf-8") as f:
-            contacts = RootModel[list[Contact]].model_validate_json(f.read()).root
+    # if the user already exists, populate the username (will be necessary later)
+    if sync_op.kc_user is not None:
+        # TODO remove sanitize_username here as usernames in keycloak should already be safe
+        update_user.username = sanitize_username(sync_op.kc_user_parsed.username)
+
+    # apply all field updates selected by the action flags in one tight loop
+    for flag, handler in UPDATE_HANDLERS:
+        if flag & actions:
+            handler(update_user, contact)
+
+    # now create or update user data, handle groups after this step
+    if actions & ACTION_CREATE:
+        # by_alias => keys that keycloak can work with
+        # exclude_none => ignore attributes not present in campai
+        update_user_json = update_user.model_dump(mode="json", by_alias=True, exclude_none=True)
+        user_id = kc_admin.create_user(update_user_json, exist_ok=False)
     else:
-        email_to_contact: dict[str, Contact] = {}
-
-        page_limit = 50
-        page_skip = 0
-
-        while True:
-            next_contacts = campai.get_contacts(organisation, page={"limit": page_limit, "skip": page_skip})
-
-            if len(next_contacts) == 0:
-                break
-
-            for contact in next_contacts:
-                # skip contacts that aren't people
-                if not contact.personal.is_person or contact.personal.is_organisation:
-                    continue
-
-                # check if a user with same e-mail has already been added to dict
-                existing_contact = email_to_contact.get(str(contact.communication.email), None)
-
-                if existing_contact is not None:
-                    # if this is the case and the already existing contact has a lower membership number
-                    # (meaning they joined earlier), leave the dict entry untouched and skip this contact.
-                    # otherwise overwrite.
-                    current_num = contact.membership.number_sort
-                    existing_num = existing_contact.membership.number_sort
-
-                    # for some reason the membership number is optional ...
-                    if current_num is None or existing_num is None:
-                        logger.warning(
-                            f"Contacts {contact.id} and {existing_contact.id} have the same e-mail address "
-                            f"({contact.communication.email}) but cannot be compared since they are missing "
-                            "an account number, using existing contact"
-                        )
-                        continue
-
-                    if contact.membership.number_sort > existing_contact.membership.number_sort:
-                        continue
+        # otherwise user already exists in keycloak and the model must be updated
+        user_id = str(sync_op.kc_user_parsed.id)
+        # update_user must receive the complete user representation so we're starting with that and
+        # calling update() on it with update_user
+        update_user_json = sync_op.kc_user
+        # by_alias => keys that keycloak can work with
+        # exclude_none => keep values that are None to remove values if they're no longer present in campai
+        # exclude_unset => do not update fields that aren't affected by sync
+        update_user_json_patch = update_user.model_dump(
+            mode="json", by_alias=True, exclude_none=False, exclude_unset=True
+        )
+        update_user_json.update(update_user_json_patch)
+        kc_admin.update_user(user_id, update_user_json)
 
-                # add user to dict (given that another user with a lower membership number isn't already present)
-                email_to_contact[str(contact.communication.email)] = contact
+    # now user_id is guaranteed to be set and can be reused for group assignment
+    if actions & ACTION_ADD_DEFAULT_GROUP:
+        kc_admin.group_user_add(user_id, str(default_group.id))
 
-            page_skip += page_limit
+    if actions & ACTION_REMOVE_ALL_GROUPS:
+        user_groups = kc.must_parse_into_groups(kc_admin.get_user_groups(user_id))
 
-        contacts = list(email_to_contact.values())
+        for group in user_groups:
+            kc_admin.group_user_remove(user_id, str(group.id))
 
-        if cache_to is not None:
-            with cache_to.open(mode="w", encoding="utf-8") as f:
-                json.dump([c.model_dump(mode="json", by_alias=True) for c in contacts], f)
 
-    logger.info(f"Found {len(contacts)} contacts")
-    logger.info("Checking necessary sync operations for each contact")
+def _do_sync(settings: Settings, cache_to: Path | None, cache_from: Path | None):
+    logger.info(f"Using Campai API at {settings.campai.base_url}")
 
-    sync_queue: list[SyncOperation] = []
+    campai = CampaiClient(
+        client=httpx.Client(
+            base_url=settings.campai.base_url,
+            auth=CampaiAuth(settings.campai.api_key.get_secret_value()),
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+            timeout=httpx.Timeout(10.0, connect=5.0),
+        )
+    )
 
-    for contact in contacts:
-        # try to find by campai ID first
-        kc_user = kc.find_user_by_campai_id(kc_admin, contact.id)
+    with campai:
+        organisations = campai.get_organisations(filter={"name": settings.sync.organisation_name})
 
-        # if that doesn't succeed, try to find by e-mail next
-        if kc_user is None and contact.communication.email is not None:
-            kc_user = kc.find_user_by_email(kc_admin, str(contact.communication.email))
+        if len(organisations) != 1:
+            logger.error(
+                f'Expected to find one organisation named "{settings.sync.organisation_name}", '
+                f"found {len(organisations)}"
+            )
+            exit(1)
 
-        # check some pre-conditions
-        is_active = is_contact_active(contact)
-        is_keycloak_user_created = kc_user is not None
+        organisation = organisations.pop()
+        logger.info(f'Found organisation named "{organisation.name}" with ID {organisation.id}')
 
-        member_actions = NO_ACTION
+        logger.info(f"Using Keycloak Admin API at {settings.keycloak.url} as {settings.keycloak.client_id}")
 
-        # check if user needs to be created
-        if is_active and not is_keycloak_user_created:
-            member_actions |= (
-                MemberAction.CREATE
-                | MemberAction.ACTIVATE
-                | MemberAction.UPDATE_FIRST_NAME
-                | MemberAction.UPDATE_LAST_NAME
-                | MemberAction.UPDATE_EMAIL
-                | MemberAction.ADD_DEFAULT_GROUP
-                | MemberAction.ADD_CAMPAI_ID
-                | MemberAction.SET_EMAIL_VALIDATED
+        kc_admin = KeycloakAdmin(
+            connection=KeycloakOpenIDConnection(
+                server_url=settings.keycloak.url,
+                realm_name=settings.keycloak.realm_name,
+                client_id=settings.keycloak.client_id,
+                client_secret_key=settings.keycloak.client_secret.get_secret_value(),
             )
+        )
 
-        # check if user needs to be updated
-        if is_keycloak_user_created:
-            user = kc.must_parse_into_user(kc_user)
-            user_groups = kc.must_parse_into_groups(kc_admin.get_user_groups(user.id))
+        default_group_raw = kc.find_group_by_name(kc_admin, settings.sync.default_group_name)
+
+        if default_group_raw is None:
+            logger.error(f'Couldn\'t find Keycloak group named "{settings.sync.default_group_name}"')
+            exit(1)
+
+        default_group = kc.must_parse_into_group(default_group_raw)
+        logger.info(f'Found group named "{default_group.name}" with ID {default_group.id}')
+        logger.info("Fetching users from Keycloak")
+
+        # fetch all users and default group members once and look contacts up in memory instead of
+        # issuing two queries per contact against the keycloak admin api
+        all_kc_users = kc_admin.get_users({})
+        kc_users_by_campai_id = kc.index_users_by_campai_id(all_kc_users)
+        kc_users_by_email = kc.index_users_by_email(all_kc_users)
+        default_group_member_ids = {
+            member["id"]
+            # only the ids are needed, so ask for the brief representation to keep the payload small
+            for member in kc_admin.get_group_members(str(default_group.id), query={"briefRepresentation": True})
+        }
+
+        logger.info(f"Found {len(all_kc_users)} users in Keycloak")
+        logger.info("Fetching users from Campai")
+
+        if cache_from is not None:
+            # the cache was validated when it was written, so validation can be skipped on load
+            contacts = [contact_from_cache(c) for c in orjson.loads(cache_from.read_bytes())]
+        else:
+            # skip contacts that aren't people
+            people = [
+                contact
+                for contact in asyncio.run(_fetch_contacts(settings, organisation))
+                if contact.personal.is_person and not contact.personal.is_organisation
+            ]
+
+            # dedup contacts that share an e-mail address by keeping the one with the lowest
+            # membership number (meaning they joined earlier). a single C-level sort with contacts
+            # missing a membership number ordered last replaces the per-contact dict guarding.
+            # for some reason the membership number is optional ...
+            people.sort(
+                key=lambda c: (
+                    str(c.communication.email),
+                    c.membership.number_sort if c.membership.number_sort is not None else math.inf,
+                )
+            )
 
-            if is_active:
-                # check if keycloak user is disabled
-                if not user.enabled:
-                    member_actions |= MemberAction.ACTIVATE
+            contacts = []
 
-                # check if default group is missing
-                if not default_group.id in [g.id for g in user_groups]:
-                    member_actions |= MemberAction.ADD_DEFAULT_GROUP
+            for email, group in itertools.groupby(people, key=lambda c: str(c.communication.email)):
+                contact = next(group)
+                duplicates = list(group)
 
-                # check if username ends with _nomember
-                if user.username.endswith(kc.NO_MEMBER_SUFFIX):
-                    member_actions |= MemberAction.REMOVE_NO_MEMBER_SUFFIX
-            else:
-                # check if user is enabled
-                if user.enabled:
-                    member_actions |= MemberAction.DEACTIVATE
+                # duplicates missing an account number sort last, so checking the first and last
+                # contact of the group is enough to detect incomparable duplicates
+                if duplicates and (
+                    contact.membership.number_sort is None or duplicates[-1].membership.number_sort is None
+                ):
+                    logger.warning(
+                        f"Multiple contacts have the same e-mail address ({email}) but cannot all be compared "
+                        f"since they are missing an account number, using contact {contact.id}"
+                    )
 
-                # check if user has any group assignments
-                if len(user_groups) > 0:
-                    member_actions |= MemberAction.REMOVE_ALL_GROUPS
+                contacts.append(contact)
 
-                # check if username doesn't end with _nomember
-                if not user.username.endswith(kc.NO_MEMBER_SUFFIX):
-                    member_actions |= MemberAction.ADD_NO_MEMBER_SUFFIX
+            if cache_to is not None:
+                # serialize in pydantic-core passes of CACHE_WRITE_CHUNK contacts so peak memory
+                # stays at one serialized chunk instead of the whole list as one JSON blob
+                with cache_to.open(mode="wb") as f:
+                    f.write(b"[")
 
-            # these operations apply to all users whether they're activated
-            # need to make email lowercase because keycloak automatically lowercases emails
-            campai_email = None if contact.communication.email is None else str(contact.communication.email).lower()
-            if user.email != campai_email:
-                member_actions |= MemberAction.UPDATE_EMAIL
+                    for chunk_start in range(0, len(contacts), CACHE_WRITE_CHUNK):
+                        if chunk_start > 0:
+                            f.write(b",")
 
-            if user.first_name != contact.personal.person_first_name:
-                member_actions |= MemberAction.UPDATE_FIRST_NAME
+                        chunk = contacts[chunk_start : chunk_start + CACHE_WRITE_CHUNK]
+                        # strip the chunk's surrounding brackets so all chunks join into one array
+                        f.write(CONTACT_LIST_ADAPTER.dump_json(chunk, by_alias=True)[1:-1])
 
-            if user.last_name != contact.personal.person_last_name:
-                member_actions |= MemberAction.UPDATE_LAST_NAME
+                    f.write(b"]")
 
-            # check if campai user id attribute exists and matches
-            if contact.id not in (user.attributes.get(kc.ATTRIBUTE_CAMPAI_ID) or []):
-                member_actions |= MemberAction.ADD_CAMPAI_ID
+        logger.info(f"Found {len(contacts)} contacts")
+        logger.info("Checking necessary sync operations for each contact")
 
-            # check if verified e-mail is unset
-            if not user.email_verified:
-                member_actions |= MemberAction.SET_EMAIL_VALIDATED
+        sync_queue: list[SyncOperation] = []
 
-        # skip users that don't need to be synced
-        if member_actions != NO_ACTION:
-            sync_queue.append(SyncOperation(kc_user=kc_user, contact=contact, actions=member_actions))
+        # match each contact to its keycloak user up front so the group memberships that the scan
+        # still needs can be prefetched in one concurrent batch
+        matched_contacts: list[tuple[Contact, dict | None]] = []
 
-    for sync_op in sync_queue:
-        contact = sync_op.contact
+        for contact in contacts:
+            # try to find by campai ID first
+            kc_user = kc_users_by_campai_id.get(contact.id, None)
 
-        if sync_op.actions == NO_ACTION:
-            continue
+            # if that doesn't succeed, try to find by e-mail next
+            if kc_user is None and contact.communication.email is not None:
+                kc_user = kc_users_by_email.get(contact.communication.email_lower, None)
 
-        if MemberAction.CREATE in sync_op.actions:
-            click.secho("[*] ", bold=True, fg="blue", nl=False)
-            click.echo(
-                f"User for {contact.personal.person_first_name} {contact.personal.person_last_name} "
-                f"(ID: {contact.id}, email: {contact.communication.email}) will be created"
-            )
+            matched_contacts.append((contact, kc_user))
 
-        if MemberAction.ACTIVATE in sync_op.actions:
-            click.secho("[*] ", bold=True, fg="green", nl=False)
-            click.echo(
-                f"User for {contact.personal.person_first_name} {contact.personal.person_last_name} "
-                f"(ID: {contact.id}, email: {contact.communication.email}) will be activated"
-            )
+        # only existing users of inactive contacts need their group assignments checked
+        group_check_user_ids = [
+            kc_user["id"]
+            for contact, kc_user in matched_contacts
+            if kc_user is not None and not is_contact_active(contact)
+        ]
 
-        if MemberAction.DEACTIVATE in sync_op.actions:
-            click.secho("[-] ", bold=True, fg="red", nl=False)
-            click.echo(
-                f"User for {contact.personal.person_first_name} {contact.personal.person_last_name} "
-                f"(ID: {contact.id}, email: {contact.communication.email}) will be deactivated"
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            user_groups_by_id = dict(
+                zip(group_check_user_ids, executor.map(kc_admin.get_user_groups, group_check_user_ids))
             )
 
-        # check if any additional actions need to be taken
-        selected_update_actions = sync_op.actions & UPDATE_ACTIONS
+        for contact, kc_user in matched_contacts:
+            # check some pre-conditions
+            is_active = is_contact_active(contact)
+            is_keycloak_user_created = kc_user is not None
+
+            member_actions = NO_ACTION
+
+            # check if user needs to be created
+            if is_active and not is_keycloak_user_created:
+                member_actions |= (
+                    MemberAction.CREATE
+                    | MemberAction.ACTIVATE
+                    | MemberAction.UPDATE_FIRST_NAME
+                    | MemberAction.UPDATE_LAST_NAME
+                    | MemberAction.UPDATE_EMAIL
+                    | MemberAction.ADD_DEFAULT_GROUP
+                    | MemberAction.ADD_CAMPAI_ID
+                    | MemberAction.SET_EMAIL_VALIDATED
+                )
 
-        if selected_update_actions != NO_ACTION:
-            click.secho("[~] ", bold=True, fg="yellow", nl=False)
-            click.echo(
-                f"User for {contact.personal.person_first_name} {contact.personal.person_last_name} "
-                f"(ID: {contact.id}, email: {contact.communication.email}) will be updated "
-                f"({repr(selected_update_actions)})"
-            )
+            # check if user needs to be updated, parse the raw user once and keep it for the apply loop
+            user = None
 
-    if len(sync_queue) == 0:
-        click.secho("[*] ", bold=True, fg="green", nl=False)
-        click.echo("No users need to be updated, we're all good :)")
-        return
+            if is_keycloak_user_created:
+                user = kc.must_parse_into_user(kc_user)
 
-    if not settings.sync.auto_apply:
-        click.confirm("Continue?", abort=True, prompt_suffix=" ")
+                if is_active:
+                    # check if keycloak user is disabled
+                    if not user.enabled:
+                        member_actions |= MemberAction.ACTIVATE
 
-    logger.info("Starting sync")
+                    # check if default group is missing
+                    if str(user.id) not in default_group_member_ids:
+                        member_actions |= MemberAction.ADD_DEFAULT_GROUP
 
-    for sync_op in sync_queue:
-        contact = sync_op.contact
-        actions = sync_op.actions
+                    # check if username ends with _nomember
+                    if user.username.endswith(kc.NO_MEMBER_SUFFIX):
+                        member_actions |= MemberAction.REMOVE_NO_MEMBER_SUFFIX
+                else:
+                    # check if user is enabled
+                    if user.enabled:
+                        member_actions |= MemberAction.DEACTIVATE
 
-        # create a new empty user that will contain fields to be updated
-        update_user = MinimalUpdateUserRepresentation()
+                    user_groups = kc.must_parse_into_groups(user_groups_by_id[kc_user["id"]])
 
-        # first check if the user needs to created, in which case a username will be generated
-        if MemberAction.CREATE in actions:
-            if contact.communication.email is None:
-                logger.warning(
-                    f"User for {contact.personal.person_first_name} {contact.personal.person_last_name} "
-                    f"cannot be created: email is missing"
-                )
-                continue
+                    # check if user has any group assignments
+                    if len(user_groups) > 0:
+                        member_actions |= MemberAction.REMOVE_ALL_GROUPS
 
-            # email is guaranteed to be valid so splitting and getting 0 index is safe
-            contact_email_name = str(contact.communication.email).split("@")[0]
+                    # check if username doesn't end with _nomember
+                    if not user.username.endswith(kc.NO_MEMBER_SUFFIX):
+                        member_actions |= MemberAction.ADD_NO_MEMBER_SUFFIX
 
-            # try to find a unique username
-            base_username = sanitize_username(contact_email_name)
-            username_idx = 0
+                # these operations apply to all users whether they're activated
+                if user.email != contact.communication.email_lower:
+                    member_actions |= MemberAction.UPDATE_EMAIL
 
-            while True:
-                username = base_username
+                if user.first_name != contact.personal.person_first_name:
+                    member_actions |= MemberAction.UPDATE_FIRST_NAME
 
-                # if username_idx == 0, then we try the base username first with no modifications
-                if username_idx > 0:
-                    # otherwise add an increasing number to the username
-                    username += str(username_idx)
+                if user.last_name != contact.personal.person_last_name:
+                    member_actions |= MemberAction.UPDATE_LAST_NAME
 
-                # if no user was found by this username, use it to create this user
-                if kc.find_user_by_username(kc_admin, username) is None:
-                    update_user.username = username
-                    break
+                # check if campai user id attribute exists and matches
+                if contact.id not in user.campai_ids:
+                    member_actions |= MemberAction.ADD_CAMPAI_ID
 
-                username_idx += 1
+                # check if verified e-mail is unset
+                if not user.email_verified:
+                    member_actions |= MemberAction.SET_EMAIL_VALIDATED
 
-        # if the user already exists, populate the username (will be necessary later)
-        if sync_op.kc_user is not None:
-            # TODO remove sanitize_username here as usernames in keycloak should already be safe
-            update_user.username = sanitize_username(kc.must_parse_into_user(sync_op.kc_user).username)
+            # skip users that don't need to be synced
+            if member_actions != NO_ACTION:
+                sync_queue.append(
+                    SyncOperation(kc_user=kc_user, kc_user_parsed=user, contact=contact, actions=member_actions)
+                )
 
-        # set enabled if active
-        if MemberAction.ACTIVATE in actions:
-            update_user.enabled = True
+        for sync_op in sync_queue:
+            contact = sync_op.contact
+            actions = int(sync_op.actions)
 
-        # set disabled if inactive
-        if MemberAction.DEACTIVATE in actions:
-            update_user.enabled = False
+            if actions == NO_ACTION:
+                continue
 
-        # update e-mail
-        if MemberAction.UPDATE_EMAIL in actions:
-            # email could be None so this must be accounted for
-            update_user.email = (
-                str(contact.communication.email).lower() if contact.communication.email is not None else None
+            # the user identity is the same in every preview line, so build it only once per op
+            who = (
+                f"User for {contact.personal.person_first_name} {contact.personal.person_last_name} "
+                f"(ID: {contact.id}, email: {contact.communication.email})"
             )
 
-        # update first name
-        if MemberAction.UPDATE_FIRST_NAME in actions:
-            update_user.first_name = contact.personal.person_first_name
+            if actions & ACTION_CREATE:
+                click.echo(PREFIX_CREATE + f"{who} will be created")
 
-        # update last name
-        if MemberAction.UPDATE_LAST_NAME in actions:
-            update_user.last_name = contact.personal.person_last_name
+            if actions & ACTION_ACTIVATE:
+                click.echo(PREFIX_ACTIVATE + f"{who} will be activated")
 
-        # add campai id
-        if MemberAction.ADD_CAMPAI_ID in actions:
-            update_user.attributes = {kc.ATTRIBUTE_CAMPAI_ID: [contact.id]}
+            if actions & ACTION_DEACTIVATE:
+                click.echo(PREFIX_DEACTIVATE + f"{who} will be deactivated")
 
-        # add _nomember suffix
-        if MemberAction.ADD_NO_MEMBER_SUFFIX in actions:
-            update_user.username = update_user.username + kc.NO_MEMBER_SUFFIX
+            # check if any additional actions need to be taken
+            selected_update_actions = actions & UPDATE_ACTIONS_MASK
 
-        # remove _nomember suffix
-        if MemberAction.REMOVE_NO_MEMBER_SUFFIX in actions:
-            update_user.username = update_user.username.rstrip(kc.NO_MEMBER_SUFFIX)
+            if selected_update_actions != NO_ACTION:
+                click.echo(PREFIX_UPDATE + f"{who} will be updated ({repr(MemberAction(selected_update_actions))})")
 
-        # set e-mail validated
-        if MemberAction.SET_EMAIL_VALIDATED in actions:
-            update_user.email_verified = True
+        if len(sync_queue) == 0:
+            click.secho("[*] ", bold=True, fg="green", nl=False)
+            click.echo("No users need to be updated, we're all good :)")
+            return
 
-        # now create or update user data, handle groups after this step
-        if MemberAction.CREATE in actions:
-            # by_alias => keys that keycloak can work with
-            # exclude_none => ignore attributes not present in campai
-            update_user_json = update_user.model_dump(mode="json", by_alias=True, exclude_none=True)
-            user_id = kc_admin.create_user(update_user_json, exist_ok=False)
-        else:
-            # otherwise user already exists in keycloak and the model must be updated
-            user_id = str(kc.must_parse_into_user(sync_op.kc_user).id)
-            # update_user must receive the complete user representation so we're starting with that and
-            # calling update() on it with update_user
-            update_user_json = sync_op.kc_user
-            # by_alias => keys that keycloak can work with
-            # exclude_none => keep values that are None to remove values if they're no longer present in campai
-            # exclude_unset => do not update fields that aren't affected by sync
-            update_user_json_patch = update_user.model_dump(
-                mode="json", by_alias=True, exclude_none=False, exclude_unset=True
-            )
-            update_user_json.update(update_user_json_patch)
-            kc_admin.update_user(user_id, update_user_json)
+        if not settings.sync.auto_apply:
+            click.confirm("Continue?", abort=True, prompt_suffix=" ")
 
-        # now user_id is guaranteed to be set and can be reused for group assignment
-        if MemberAction.ADD_DEFAULT_GROUP in actions:
-            kc_admin.group_user_add(user_id, str(default_group.id))
+        logger.info("Starting sync")
 
-        if MemberAction.REMOVE_ALL_GROUPS in actions:
-            user_groups = kc.must_parse_into_groups(kc_admin.get_user_groups(user_id))
+        # users are independent of each other, so the keycloak writes are issued through a
+        # bounded thread pool; usernames picked for new users are claimed under a shared lock so
+        # concurrent creates cannot collide
+        claimed_usernames: set[str] = set()
+        apply_sync_op = partial(_apply_sync_op, kc_admin, default_group, claimed_usernames, threading.Lock())
 
-            for group in user_groups:
-                kc_admin.group_user_remove(user_id, str(group.id))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(apply_sync_op, sync_queue))
 
 
 @app.command()
@@ -1,9 +1,9 @@
-import json
+from functools import cached_property
 from typing import Annotated
 
 from keycloak import KeycloakAdmin
 from loguru import logger
-from pydantic import BaseModel, ConfigDict, Field, EmailStr, UUID4, RootModel
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, UUID4, TypeAdapter
 from pydantic.alias_generators import to_camel
 
 
@@ -18,11 +18,17 @@ class MinimalUserRepresentation(BaseModel):
     enabled: bool
     username: str
     id: UUID4
-    email: EmailStr | None = None
+    # emails coming back from keycloak are already validated, so re-running email-validator on
+    # every parsed user is wasted work
+    email: str | None = None
     email_verified: bool
     attributes: Annotated[dict[str, list[str]], Field(default_factory=dict)]
     groups: Annotated[list[str], Field(default_factory=list)]
 
+    @cached_property
+    def campai_ids(self) -> frozenset[str]:
+        return frozenset(self.attributes.get(ATTRIBUTE_CAMPAI_ID) or ())
+
 
 class MinimalUpdateUserRepresentation(BaseModel):
     model_config = ConfigDict(alias_generator=to_camel, validate_by_name=True)
@@ -46,9 +52,8 @@ def _find_user_by_query(kc_admin: KeycloakAdmin, query: dict) -> dict | None:
 
     if len(users) != 1:
         if len(users) > 1:
-            logger.warning(
-                f"Query {json.dumps(query)} returned more than one result while expecting to get at most one"
-            )
+            # let loguru format lazily so the query is only serialized if the message is emitted
+            logger.warning("Query {} returned more than one result while expecting to get at most one", query)
 
         return None
 
@@ -67,6 +72,23 @@ def find_user_by_username(kc_admin: KeycloakAdmin, username: str) -> dict | None
     return _find_user_by_query(kc_admin, {"username": username, "exact": True})
 
 
+def find_taken_usernames(kc_admin: KeycloakAdmin, username_prefix: str) -> set[str]:
+    # the non-exact username query matches substrings, which is a superset of all prefix matches
+    return {user["username"] for user in kc_admin.get_users({"username": username_prefix, "exact": False})}
+
+
+def index_users_by_campai_id(users: list[dict]) -> dict[str, dict]:
+    return {
+        campai_id: user
+        for user in users
+        for campai_id in (user.get("attributes", {}) or {}).get(ATTRIBUTE_CAMPAI_ID, [])
+    }
+
+
+def index_users_by_email(users: list[dict]) -> dict[str, dict]:
+    return {user["email"].lower(): user for user in users if user.get("email")}
+
+
 def find_group_by_name(kc_admin: KeycloakAdmin, name: str) -> dict | None:
     groups = kc_admin.get_groups(query={"search": name})
 
@@ -84,5 +106,9 @@ def must_parse_into_group(value: dict) -> MinimalGroupRepresentation:
     return MinimalGroupRepresentation.model_validate(value)
 
 
+# built once at import so the compiled list validator is reused across all calls
+GROUP_LIST_ADAPTER = TypeAdapter(list[MinimalGroupRepresentation])
+
+
 def must_parse_into_groups(value: list[dict]) -> list[MinimalGroupRepresentation]:
-    return RootModel[list[MinimalGroupRepresentation]].model_validate(value).root
+    return GROUP_LIST_ADAPTER.validate_python(value)
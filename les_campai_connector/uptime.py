@@ -31,10 +31,15 @@ def check_response(resp: httpx.Response):
     raise ValueError(f"uptime endpoint returned unexpected status code {resp.status_code}")
 
 
+# one client shared by all UptimeKumaClient instances so up/down pings reuse the same
+# connection pool instead of each instance opening its own
+_shared_client = httpx.Client()
+
+
 class UptimeKumaClient(object):
     def __init__(self, uptime_endpoint_url: str):
         self.__uptime_endpoint_url = uptime_endpoint_url
-        self.__client = httpx.Client()
+        self.__client = _shared_client
 
     def up(self, message="OK"):
         check_response(self.__client.get(self.__uptime_endpoint_url, params={"status": "up", "msg": message}))